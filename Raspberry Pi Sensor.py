@@ -11,30 +11,88 @@ Hardware:
 - 2x ADS1115 ADCs (commented out placeholders for now)
 - 2x Photodiodes
 - 1x ST7789-based 2" LCD Display (Waveshare)
+
+Setup:
+- Run the I2C bus at 400 kHz by adding `dtparam=i2c_arm_baudrate=400000` to /boot/config.txt
+- Optionally let the kernel drive the LCD by adding
+  `dtoverlay=fbtft,spi0-0,st7789v,width=240,height=320,dc_pin=25,reset_pin=18,led_pin=12`
+  to /boot/config.txt. When /dev/fb1 shows up it gets used instead of the Python SPI driver.
 """
 
+import mmap
+import os
+import struct
 import time
+import threading
+from bisect import bisect_right
+from functools import lru_cache
 import board
 import busio
 import digitalio
+import numpy as np
+import spidev
 from adafruit_rgb_display import st7789
 from PIL import Image, ImageDraw, ImageFont
-from adafruit_ads1x15.ads1115 import ADS1115
-# from adafruit_ads1x15.ads1x15 import ADS
-from adafruit_ads1x15.analog_in import AnalogIn
+from smbus2 import SMBus, i2c_msg
 
 
 # === Constants and Calibration Values ===
 FEEDBACK_RESISTOR = 430  # Ohms
 RESPONSIVITY = 1  # A/W
-V_OPAMP_INPUT = 3.3  # V (TIA virtual ground)
+V_OPAMP_INPUT = 3.3  # V (TIA virtual ground), cancels out since power is taken vs the baseline
+INV_R_RESP = 1.0 / (FEEDBACK_RESISTOR * RESPONSIVITY)  # W per V, multiply instead of divide
 
 DISPLAY_WIDTH = 240
 DISPLAY_HEIGHT = 320
 DISPLAY_ROTATION = 0  # no rotation
 
+# The Pi makes the SPI clock by dividing down the 250 MHz core clock, so asking for 64 MHz
+# really gets 62.5 MHz. Asking for what we actually get so the numbers are honest.
+SPI_BAUDRATE = 62500000
+
+# fbtft exposes the LCD here when the overlay is loaded
+FB_DEVICE = "/dev/fb1"
+FB_SYSFS = "/sys/class/graphics/fb1"
+
+# ST7789 commands used when pushing pixels ourselves
+ST7789_CASET = 0x2A  # column address window
+ST7789_RASET = 0x2B  # row address window
+ST7789_RAMWR = 0x2C  # pixel data follows
+
 REFRESH_DELAY = 1e-2 # seconds
 
+# Printing every loop was most of the loop time, so it's off unless debugging. When on, the
+# loop timings get collected and printed as a summary once a second instead.
+DEBUG = False
+DEBUG_INTERVAL_NS = 1_000_000_000  # time between debug reports (1 s)
+TIMING_SAMPLES = 1024  # max loop timings kept per report
+
+# === ADS1115 Registers ===
+# Talking to the ADCs directly over smbus2 instead of going through adafruit_ads1x15, which
+# piles a bunch of property lookups and sleeps on top of every single read.
+I2C_BUS = 1
+ADS1_ADDRESS = 0x48
+ADS2_ADDRESS = 0x49
+ADS_REG_CONVERSION = 0x00
+ADS_REG_CONFIG = 0x01
+
+# Continuous conversion, AIN0 vs GND, +/-4.096 V, 860 SPS, comparator off. In continuous mode
+# the ADC keeps converting on its own so a sample is just a read of the conversion register.
+ADS_CONFIG_CONTINUOUS = [0xC2, 0xE3]
+ADS_VOLTS_PER_BIT = 4.096 / 32768
+ADS_SAMPLE_PERIOD = 1.2e-3  # seconds, a bit over one conversion at 860 SPS
+I2C_MAX_FAILURES = 10  # failed reads in a row before the sampler gives up
+SAMPLE_TIMEOUT = 1.0  # seconds without a new sample before the display loop calls it broken
+
+# === Power Units ===
+# Instead of an elif ladder, bisect the power into one of these buckets:
+# [0] < 1 nW, [1] nW, [2] μW, [3] mW, [4] W
+POWER_THRESHOLDS = (1e-9, 1e-6, 1e-3, 1.0)
+POWER_SCALES = (0.0, 1e9, 1e6, 1e3, 1.0)
+POWER_FORMATS = ("<1 nW", "{:.3f} nW", "{:.3f} μW", "{:.3f} mW", "{:.2f} W")
+# Bars fill up at 1000 of the current unit, anything 1 W and above is a full bar
+BAR_SCALES = (0.0, 1e6, 1e3, 1.0, 1.0)
+
 # Colors (R, G, B)
 CREAM = (255, 235, 205)  # Slightly more orange/red cream background
 MAROON = (128, 0, 0)
@@ -42,32 +100,97 @@ BLACK = (0, 0, 0)
 
 LETTER_SIZE = 23
 
-# === Setup Backlight ===
-bl = digitalio.DigitalInOut(board.D12)  # Backlight pin
-bl.direction = digitalio.Direction.OUTPUT
-bl.value = True  # Turn backlight ON
-
-# === Setup SPI and Display Pins ===
-spi = busio.SPI(clock=board.SCLK, MOSI=board.MOSI)
-while not spi.try_lock():
-    pass
-spi.configure(baudrate=64000000)
-spi.unlock()
-
-cs = digitalio.DigitalInOut(board.CE0)  # GPIO8 / CE0
-dc = digitalio.DigitalInOut(board.D25)  # GPIO25
-reset = digitalio.DigitalInOut(board.D18)  # GPIO18
-
-disp = st7789.ST7789(
-    spi,
-    cs=cs,
-    dc=dc,
-    rst=reset,
-    width=DISPLAY_WIDTH,
-    height=DISPLAY_HEIGHT,
-    rotation=DISPLAY_ROTATION,
-    baudrate=64000000,
-)
+# === Dynamic Region Layout (x, y in pixels) ===
+TEXT_X = 100
+TEXT_W = DISPLAY_WIDTH - 10 - TEXT_X
+TEXT_H = 20
+TEXT1_Y = 80
+TEXT2_Y = 190
+
+BAR_X = 12
+BAR_W = DISPLAY_WIDTH - 2 * BAR_X  # inside of the bar border
+BAR_H = 27
+BAR1_Y = 142
+BAR2_Y = 252
+
+
+# === Setup Display ===
+def read_fb_sysfs(attr):
+    with open(os.path.join(FB_SYSFS, attr)) as f:
+        return f.read().strip()
+
+
+def framebuffer_usable():
+    # /dev/fb1 could be anything (a second HDMI output, a USB display...), so only use it if it
+    # really is the st7789v fbtft driver in the 240x320, 16 bpp, unrotated layout fb565 assumes
+    if not os.path.exists(FB_DEVICE):
+        return False
+    try:
+        name = read_fb_sysfs("name")
+        size = read_fb_sysfs("virtual_size")
+        bpp = read_fb_sysfs("bits_per_pixel")
+        stride = read_fb_sysfs("stride")
+    except OSError:
+        return False
+
+    if ("st7789" in name and size == f"{DISPLAY_WIDTH},{DISPLAY_HEIGHT}" and bpp == "16"
+            and stride == str(DISPLAY_WIDTH * 2)):
+        return True
+    print(f"Not using {FB_DEVICE} ({name}, {size} at {bpp} bpp, stride {stride}), "
+          "driving the LCD over SPI instead")
+    return False
+
+
+# If the fbtft overlay is loaded the kernel owns the panel and handles SPI/DMA itself, we just
+# write RGB565 pixels into the memory mapped framebuffer. Otherwise drive the ST7789 from here.
+#
+# Either way fb565 is the persistent RGB565 framebuffer. Everything that ends up on the screen
+# lives in there and the dynamic parts get updated with numpy slice writes.
+USE_FRAMEBUFFER = framebuffer_usable()
+
+if USE_FRAMEBUFFER:
+    fb_fd = os.open(FB_DEVICE, os.O_RDWR)
+    fb_mmap = mmap.mmap(fb_fd, DISPLAY_WIDTH * DISPLAY_HEIGHT * 2)
+    fb565 = np.frombuffer(fb_mmap, dtype=np.uint16).reshape(DISPLAY_HEIGHT, DISPLAY_WIDTH)
+else:
+    # Big-endian since that is what the ST7789 wants on the wire, so a region can go out as is
+    fb565 = np.zeros((DISPLAY_HEIGHT, DISPLAY_WIDTH), dtype=">u2")
+
+    # === Setup Backlight ===
+    bl = digitalio.DigitalInOut(board.D12)  # Backlight pin
+    bl.direction = digitalio.Direction.OUTPUT
+    bl.value = True  # Turn backlight ON
+
+    # === Setup SPI and Display Pins ===
+    # No need to lock and configure this ourselves, the driver sets the baudrate every time it
+    # takes the bus anyway
+    spi = busio.SPI(clock=board.SCLK, MOSI=board.MOSI)
+
+    cs = digitalio.DigitalInOut(board.CE0)  # GPIO8 / CE0
+    dc = digitalio.DigitalInOut(board.D25)  # GPIO25
+    reset = digitalio.DigitalInOut(board.D18)  # GPIO18
+
+    disp = st7789.ST7789(
+        spi,
+        cs=cs,
+        dc=dc,
+        rst=reset,
+        width=DISPLAY_WIDTH,
+        height=DISPLAY_HEIGHT,
+        rotation=DISPLAY_ROTATION,
+        baudrate=SPI_BAUDRATE,
+    )
+
+    # The driver above (through Blinka) opens and closes /dev/spidev0.0 on every single write.
+    # For the pixel pushes we keep our own handle open and drive cs/dc ourselves.
+    panel_spi = spidev.SpiDev()
+    panel_spi.open(0, 0)
+    panel_spi.max_speed_hz = SPI_BAUDRATE
+    panel_spi.mode = 0
+    try:
+        panel_spi.no_cs = True  # cs is toggled through digitalio like the driver does
+    except OSError:
+        pass
 
 # === Load Fonts ===
 try:
@@ -77,50 +200,98 @@ except:
     font = ImageFont.load_default()
     font_small = ImageFont.load_default()
 
+# === Calibration Screen Layout ===
+# The calibration message never changes, so center it once here instead of measuring every
+# line each time the screen gets shown
+CALIB_TEXT = "Calibrating...\nPlease block laser"
+
+
+def layout_centered(text, font):
+    # Returns (line, x, y) for each line so the whole block sits in the middle of the screen
+    lines = text.split('\n')
+    sizes = []
+    for line in lines:
+        bbox = font.getbbox(line)
+        sizes.append((bbox[2] - bbox[0], bbox[3] - bbox[1]))
+
+    x = (DISPLAY_WIDTH - max(w for w, _ in sizes)) // 2
+    y = (DISPLAY_HEIGHT - sum(h for _, h in sizes)) // 2
+
+    placed = []
+    for line, (_, h) in zip(lines, sizes):
+        placed.append((line, x, y))
+        y += h
+    return placed
+
 
-# === Global persistent image and draw context ===
-static_img = None
-draw = None
+CALIB_LINES = layout_centered(CALIB_TEXT, font)
+
+
+# === Glyph Atlas ===
+# Every character a power reading can contain, rendered once here. Readings get built out of
+# these masks in render_text so FreeType never runs once the loop is going.
+GLYPH_CHARS = "0123456789. <nμmW"
+
+
+def build_glyph_atlas():
+    atlas = {}
+    for ch in GLYPH_CHARS:
+        right = font_small.getbbox(ch)[2]
+        img = Image.new("L", (max(right, 1), TEXT_H), 0)
+        ImageDraw.Draw(img).text((0, 0), ch, font=font_small, fill=255)
+        # (coverage mask 0-1, how far to move over for the next character)
+        atlas[ch] = (np.asarray(img, dtype=np.float32) / 255, font_small.getlength(ch))
+    return atlas
+
+
+glyph_atlas = build_glyph_atlas()
+
+# === Dirty Regions ===
+# Only the regions that actually changed get pushed to the display. last_drawn remembers what
+# each region (keyed by its y position) is currently showing so repeats can be skipped.
+dirty_rects = []  # (x, y, w, h)
+last_drawn = {}
+
+# === ADC Read Messages ===
+# 2 byte reads of whatever register each ADC is pointing at, which start_continuous sets to the
+# conversion register once. Built once and reused, the read buffers just get overwritten.
+# Note: both ADCs can't go in one I2C_RDWR, the Pi's i2c-bcm2835 driver only allows a single
+# read message and it has to be the last one, so it's one transfer per ADC.
+ads1_read = i2c_msg.read(ADS1_ADDRESS, 2)
+ads2_read = i2c_msg.read(ADS2_ADDRESS, 2)
+
+# === Shared ADC sample ===
+# The sampler thread keeps overwriting this with the newest (v1, v2) pair so the display
+# loop never has to sit around waiting on an I2C conversion. new_sample gets set every time
+# there's a fresh pair so the display loop can sleep until then instead of spinning.
+latest_sample = [0.0, 0.0]
+sample_lock = threading.Lock()
+new_sample = threading.Event()
+sampler_error = None  # whatever stopped the sampler thread, checked by the display loop
 
 
 # === Helper Functions ===
 
-def compute_power(v_in, v_out, r_feedback=FEEDBACK_RESISTOR, responsivity=RESPONSIVITY):
-    return (v_out - v_in) / (r_feedback * responsivity) # Note I am writing this as negative because inverting
+def to565(rgb):
+    # RGB888 -> RGB565 as plain uint16s, works on a whole image or a single color
+    rgb = np.asarray(rgb, dtype=np.uint16)
+    return ((rgb[..., 0] & 0xF8) << 8) | ((rgb[..., 1] & 0xFC) << 3) | (rgb[..., 2] >> 3)
+
+
+CREAM_565 = to565(CREAM)
+MAROON_565 = to565(MAROON)
 
-def format_power(power):
-    abs_p = abs(power)
-    if abs_p == 0:
-        return "0 W"
-    elif abs_p < 1e-9:
-        return "<1 nW"
-    elif abs_p < 1e-6:
-        return f"{abs_p * 1e9:.3f} nW"
-    elif abs_p < 1e-3:
-        return f"{abs_p * 1e6:.3f} μW"
-    elif abs_p < 1:
-        return f"{abs_p * 1e3:.3f} mW"
-    else:
-        return f"{abs_p:.2f} W"
 
-def power_to_fraction(power):
+def render_power(power):
+    # Returns the display text and bar fraction together so the unit only gets picked once
     abs_p = abs(power)
     if abs_p == 0:
-        return 0.0
-    elif abs_p < 1e-9:
-        return 0.0
-    elif abs_p < 1e-6:
-        return min((abs_p * 1e9) / 1000, 1.0)
-    elif abs_p < 1e-3:
-        return min((abs_p * 1e6) / 1000, 1.0)
-    elif abs_p < 1:
-        return min((abs_p * 1e3) / 1000, 1.0)
-    else:
-        return 1.0
+        return "0 W", 0.0
+    i = bisect_right(POWER_THRESHOLDS, abs_p)
+    return POWER_FORMATS[i].format(abs_p * POWER_SCALES[i]), min(abs_p * BAR_SCALES[i], 1.0)
 
 
 def draw_static_elements():
-    global static_img, draw
     static_img = Image.new("RGB", (DISPLAY_WIDTH, DISPLAY_HEIGHT), CREAM)
     draw = ImageDraw.Draw(static_img)
 
@@ -135,38 +306,117 @@ def draw_static_elements():
     draw.text((10, 190), "Power 2:", font=font_small, fill=MAROON)
     draw.rectangle([10, 250, DISPLAY_WIDTH - 10, 280], outline=BLACK, width=2)
 
-    disp.image(static_img)
+    last_drawn.clear()
+    dirty_rects.clear()
+    show_image(static_img)
+
+
+TEXT_CACHE_SIZE = 512  # readings only jitter in the last digit, so strings repeat a lot
+
+
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
+def render_text(text):
+    # Builds a power reading out of the atlas glyphs on its own little strip, blended from
+    # cream to maroon and already in RGB565, so it can be copied into the framebuffer. Cached so
+    # repeated readings skip even that and are just a copy.
+    coverage = np.zeros((TEXT_H, TEXT_W), dtype=np.float32)
+    x = 0.0
+    for ch in text:
+        mask, advance = glyph_atlas[ch]
+        x0 = round(x)
+        w = min(mask.shape[1], TEXT_W - x0)
+        if w > 0:
+            strip = coverage[:, x0:x0 + w]
+            np.maximum(strip, mask[:, :w], out=strip)
+        x += advance
+
+    cream = np.array(CREAM, dtype=np.float32)
+    maroon = np.array(MAROON, dtype=np.float32)
+    rgb = cream + coverage[..., None] * (maroon - cream)
+    return to565(rgb.round())
+
+
+def draw_text(y, text):
+    if last_drawn.get(y) == text:
+        return
+    last_drawn[y] = text
+    fb565[y:y + TEXT_H, TEXT_X:TEXT_X + TEXT_W] = render_text(text)
+    dirty_rects.append((TEXT_X, y, TEXT_W, TEXT_H))
+
+
+def draw_bar(y, frac):
+    fill = int(BAR_W * frac)
+    old_fill = last_drawn.get(y)
+    if old_fill == fill:
+        return
+    last_drawn[y] = fill
+
+    if old_fill is None:
+        # First draw after a static screen, do the whole bar
+        lo, hi = 0, BAR_W
+    else:
+        # Only the columns between the old and new end of the bar actually change
+        lo, hi = min(old_fill, fill), max(old_fill, fill)
+
+    bar = fb565[y:y + BAR_H, BAR_X:BAR_X + BAR_W]
+    bar[:, lo:fill] = MAROON_565
+    bar[:, max(lo, fill):hi] = CREAM_565
+    dirty_rects.append((BAR_X + lo, y, hi - lo, BAR_H))
 
 
-def update_dynamic_elements(power1, power2):
-    global static_img, draw
+def panel_write(command, data):
+    # Command byte with dc low, then all of the data with dc high in one bulk transfer
+    cs.value = False
+    dc.value = False
+    panel_spi.writebytes2([command])
+    dc.value = True
+    panel_spi.writebytes2(data)
+    cs.value = True
 
-    # Erase old values (just the power reading areas)
-    draw.rectangle([100, 80, DISPLAY_WIDTH - 10, 100], fill=CREAM)
-    draw.rectangle([100, 190, DISPLAY_WIDTH - 10, 210], fill=CREAM)
 
-    # Draw new power text
-    p1_text = format_power(power1)
-    p2_text = format_power(power2)
-    draw.text((100, 80), p1_text, font=font_small, fill=MAROON)
-    draw.text((100, 190), p2_text, font=font_small, fill=MAROON)
+def push_region(x, y, w, h):
+    if USE_FRAMEBUFFER:
+        return  # fbtft already picked up the write into the mmap and sends it on its own
 
-    # Erase bars area before redrawing bars
-    draw.rectangle([12, 142, DISPLAY_WIDTH - 12, 168], fill=CREAM)
-    draw.rectangle([12, 252, DISPLAY_WIDTH - 12, 278], fill=CREAM)
+    # Sets the column/row address window and writes just those pixels
+    panel_write(ST7789_CASET, struct.pack(">HH", x, x + w - 1))
+    panel_write(ST7789_RASET, struct.pack(">HH", y, y + h - 1))
+    panel_write(ST7789_RAMWR, fb565[y:y + h, x:x + w].tobytes())
 
-    # Draw power bars
-    bar_width = DISPLAY_WIDTH - 20
-    p1_frac = power_to_fraction(power1)
-    p2_frac = power_to_fraction(power2)
 
-    if p1_frac > 0:
-        draw.rectangle([12, 142, 12 + int(bar_width * p1_frac), 168], fill=MAROON)
-    if p2_frac > 0:
-        draw.rectangle([12, 252, 12 + int(bar_width * p2_frac), 278], fill=MAROON)
+def check_spi_clock():
+    # The SPI clock can end up slower than asked for without any error, so time a full frame
+    # push (what's already on screen, so nothing visibly changes) and report the real rate
+    start = time.monotonic_ns()
+    push_region(0, 0, DISPLAY_WIDTH, DISPLAY_HEIGHT)
+    elapsed = (time.monotonic_ns() - start) / 1e9
+    mhz = DISPLAY_WIDTH * DISPLAY_HEIGHT * 16 / elapsed / 1e6
+    print(f"SPI clock: asked for {SPI_BAUDRATE / 1e6:.1f} MHz, full frame took {elapsed * 1e3:.1f} ms "
+          f"(~{mhz:.1f} MHz effective)")
 
-    # Send updated image to display
-    disp.image(static_img)
+
+def show_image(img):
+    # Full screen draw, only used for the static screens so the whole frame gets converted
+    fb565[:] = to565(np.asarray(img))
+    push_region(0, 0, DISPLAY_WIDTH, DISPLAY_HEIGHT)
+
+
+def update_dynamic_elements(power1, power2):
+    p1_text, p1_frac = render_power(power1)
+    p2_text, p2_frac = render_power(power2)
+
+    # Power text
+    draw_text(TEXT1_Y, p1_text)
+    draw_text(TEXT2_Y, p2_text)
+
+    # Power bars
+    draw_bar(BAR1_Y, p1_frac)
+    draw_bar(BAR2_Y, p2_frac)
+
+    # Send only the changed regions to the display
+    for rect in dirty_rects:
+        push_region(*rect)
+    dirty_rects.clear()
 
 
 # === Adding in a function to calculate proper offsets ===
@@ -176,120 +426,186 @@ Samples for us to compute the proper offsets because this shit is fucked and the
 us to have the proper power readings. If this doesn't work I am looking into nearby bridges
 with `excellent city views`
 """
-def calibrate_baseline(chan1, chan2, num_samples=500, delay=0.1):
+def calibrate_baseline(bus, num_samples=500, delay=ADS_SAMPLE_PERIOD):
     show_calibrating_screen() # shows the message on the lcd screen
 
     print("Calibrating baseline... Please ensure no laser light on photodiodes.")
-    v1_total = 0.0
-    v2_total = 0.0
+    v1_samples = np.empty(num_samples, dtype=np.float32)
+    v2_samples = np.empty(num_samples, dtype=np.float32)
 
-    for _ in range(num_samples):
-        v1_total += chan1.voltage
-        v2_total += chan2.voltage
-        time.sleep(delay)  # Wait between samples
+    for i in range(num_samples):
+        v1_samples[i], v2_samples[i] = read_voltages_retrying(bus)
+        time.sleep(delay)  # Wait for the next conversion so we don't read the same one twice
 
-    v1_offset = v1_total / num_samples
-    v2_offset = v2_total / num_samples
+    v1_offset = float(v1_samples.mean())
+    v2_offset = float(v2_samples.mean())
 
     print(f"Calibration done. Baseline voltages: v1_offset={v1_offset:.4f} V, v2_offset={v2_offset:.4f} V")
     return v1_offset, v2_offset
 
 
+def start_continuous(bus):
+    # Only needs to happen once, after this both ADCs convert back to back forever
+    bus.write_i2c_block_data(ADS1_ADDRESS, ADS_REG_CONFIG, ADS_CONFIG_CONTINUOUS)
+    bus.write_i2c_block_data(ADS2_ADDRESS, ADS_REG_CONFIG, ADS_CONFIG_CONTINUOUS)
+
+    # Leave both pointed at the conversion register. The pointer sticks between reads, so
+    # samples after this are just a plain 2 byte read.
+    bus.write_byte(ADS1_ADDRESS, ADS_REG_CONVERSION)
+    bus.write_byte(ADS2_ADDRESS, ADS_REG_CONVERSION)
+    time.sleep(ADS_SAMPLE_PERIOD)  # let the first conversion finish
+
+
+def read_voltages(bus):
+    # Signed 16 bit results of the most recent conversion on both ADCs
+    bus.i2c_rdwr(ads1_read)
+    bus.i2c_rdwr(ads2_read)
+    v1 = int.from_bytes(bytes(ads1_read), "big", signed=True) * ADS_VOLTS_PER_BIT
+    v2 = int.from_bytes(bytes(ads2_read), "big", signed=True) * ADS_VOLTS_PER_BIT
+    return v1, v2
+
+
+def read_voltages_retrying(bus):
+    # One off errors (EREMOTEIO and friends) happen on these buses, so just try again.
+    # A whole run of them means the ADCs are really gone though.
+    failures = 0
+    while True:
+        try:
+            return read_voltages(bus)
+        except OSError:
+            failures += 1
+            if failures >= I2C_MAX_FAILURES:
+                raise
+            time.sleep(ADS_SAMPLE_PERIOD)
+
+
+def sample_loop(bus):
+    while True:
+        v1, v2 = read_voltages_retrying(bus)
+        with sample_lock:
+            latest_sample[:] = [v1, v2]
+        new_sample.set()
+        time.sleep(ADS_SAMPLE_PERIOD)  # no new conversion before this anyway
+
+
+def sample_worker(bus):
+    # Runs in its own thread. The I2C reads are blocking but release the GIL while waiting,
+    # so the main loop keeps drawing in the meantime. If it dies the error gets handed to the
+    # display loop, otherwise the screen would just sit there showing the last reading.
+    global sampler_error
+    try:
+        sample_loop(bus)
+    except Exception as e:
+        sampler_error = e
+        new_sample.set()  # wake the display loop so it notices
+
+
 #This is so the screen isnt just green for the calibration
 def show_calibrating_screen():
     image = Image.new("RGB", (DISPLAY_WIDTH, DISPLAY_HEIGHT), CREAM)
     draw = ImageDraw.Draw(image)
 
-    try:
-        font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", LETTER_SIZE)
-    except:
-        font = ImageFont.load_default()
+    for line, x, y in CALIB_LINES:
+        draw.text((x, y), line, font=font, fill=MAROON)
 
-    text = "Calibrating...\nPlease block laser"
-    lines = text.split('\n')
+    show_image(image)
 
-    max_width = 0
-    total_height = 0
-    line_heights = []
 
-    for line in lines:
-        bbox = draw.textbbox((0, 0), line, font=font)
-        w = bbox[2] - bbox[0]
-        h = bbox[3] - bbox[1]
-        if w > max_width:
-            max_width = w
-        line_heights.append(h)
-        total_height += h
-
-    x = (DISPLAY_WIDTH - max_width) // 2
-    y = (DISPLAY_HEIGHT - total_height) // 2
-
-    for i, line in enumerate(lines):
+def show_error_screen(text):
+    # Replaces the readings so a dead sensor doesn't leave a believable number on the screen
+    image = Image.new("RGB", (DISPLAY_WIDTH, DISPLAY_HEIGHT), CREAM)
+    draw = ImageDraw.Draw(image)
+
+    for line, x, y in layout_centered(text, font):
         draw.text((x, y), line, font=font, fill=MAROON)
-        y += line_heights[i]
 
-    disp.image(image)
+    show_image(image)
 
 
 # === Main Loop ===
 def main():
-    i2c = busio.I2C(board.SCL, board.SDA)
-    ads1 = ADS1115(i2c, address=0x48)
-    ads2 = ADS1115(i2c, address=0x49)
-    chan1 = AnalogIn(ads1, 0)
-    chan2 = AnalogIn(ads2, 0)
-
-    # This is to make suer we are running smoothly and fast.
-    ads1.data_rate = 860  # max 860 samples per second
-    ads2.data_rate = 860
-
-    # this is setting the gain for the system
-    # ads1.gain = 1  # ±4.096 V range
-    # ads2.gain = 1
-    # Note these did not work and something got wonky
-
-    # Calibrate baseline before main reading loop
-    v1_offset, v2_offset = calibrate_baseline(chan1, chan2, num_samples=500, delay=0.1)
-    iteration = 0
-
-    # Draw static elements once at the start (initializes global static_img and draw)
-    draw_static_elements()
-
-    while True:
-        total_start = time.time()
-        math_start = time.time()
+    # Data rate (860 SPS) and gain (+/-4.096 V, same as the adafruit default) are both set
+    # in ADS_CONFIG_CONTINUOUS
+    bus = SMBus(I2C_BUS)
 
-        v1_raw = chan1.voltage
-        v2_raw = chan2.voltage
-
-        # Subtract baseline offsets
-        v1 = v1_raw - v1_offset
-        v2 = v2_raw - v2_offset
+    # Calibrate baseline before main reading loop. If the ADCs can't be read at all, say so on
+    # the screen instead of leaving the calibration message up for good.
+    try:
+        start_continuous(bus)
+        v1_offset, v2_offset = calibrate_baseline(bus, num_samples=500)
+    except OSError:
+        show_error_screen("Sensor error\nCheck the ADCs")
+        raise
+    iteration = 0
 
-        power1_raw = compute_power(V_OPAMP_INPUT, v1_raw)
-        power2_raw = compute_power(V_OPAMP_INPUT, v2_raw)
+    if not USE_FRAMEBUFFER:
+        check_spi_clock()
 
-        power1_offset = compute_power(V_OPAMP_INPUT, v1_offset)
-        power2_offset = compute_power(V_OPAMP_INPUT, v2_offset)
+    # Seed the shared sample and start reading the ADCs in the background
+    latest_sample[:] = [v1_offset, v2_offset]
+    sampler = threading.Thread(target=sample_worker, args=(bus,), daemon=True)
+    sampler.start()
 
-        power1 = abs(power1_raw - power1_offset)
-        power2 = abs(power2_raw - power2_offset)
+    # Draw static elements once at the start (initializes the global framebuffer)
+    draw_static_elements()
 
-        math_stop = time.time()
-        print(f"=== Iteration: {iteration} ===")
-        print(f"Time to run: {math_stop-math_start} seconds")
-        print(f"voltage 1 (raw): {v1_raw:.4f} V, voltage 2 (raw): {v2_raw:.4f} V")
-        print(f"voltage 1 (offset): {v1:.4f} V, voltage 2 (offset): {v2:.4f} V")
-        print(f"Power 1: {power1:.6f} W, Power 2: {power2:.6f} W")
+    # Debug timing buffers, preallocated so recording a loop is just two array writes. Times are
+    # integer nanoseconds from the monotonic clock so NTP adjustments can't mess with them.
+    loop_times = np.zeros(TIMING_SAMPLES, dtype=np.int64)
+    disp_times = np.zeros(TIMING_SAMPLES, dtype=np.int64)
+    timed = 0
+    next_report = time.monotonic_ns() + DEBUG_INTERVAL_NS
 
-        disp_start = time.time()
+    while True:
+        # Nothing to draw until the ADCs have something new, so block instead of spinning the CPU.
+        # Samples normally show up every ~1 ms, so going a whole SAMPLE_TIMEOUT without one
+        # means the sampler died or is stuck in an I2C call.
+        got_sample = new_sample.wait(timeout=SAMPLE_TIMEOUT)
+        new_sample.clear()
+
+        if sampler_error is not None:
+            show_error_screen("Sensor error\nCheck the ADCs")
+            raise RuntimeError("ADC sampler thread stopped") from sampler_error
+        if not got_sample:
+            show_error_screen("Sensor error\nCheck the ADCs")
+            if not sampler.is_alive():
+                raise RuntimeError("ADC sampler thread stopped")
+            raise RuntimeError(f"No ADC samples for {SAMPLE_TIMEOUT} s")
+
+        if DEBUG:
+            loop_start = time.monotonic_ns()
+
+        with sample_lock:
+            v1_raw, v2_raw = latest_sample
+
+        # (v_raw - 3.3)/R - (v_offset - 3.3)/R, the virtual ground drops out
+        power1 = abs(v1_raw - v1_offset) * INV_R_RESP
+        power2 = abs(v2_raw - v2_offset) * INV_R_RESP
+
+        if DEBUG:
+            disp_start = time.monotonic_ns()
         update_dynamic_elements(power1, power2)
-        disp_stop = time.time()
 
         iteration += 1
         # time.sleep(REFRESH_DELAY)
-        total_stop = time.time()
-        print(f"dosplay run time: {disp_stop-disp_start} seconds | Total loop run time: {total_stop-total_start} seconds")
+
+        if DEBUG:
+            loop_stop = time.monotonic_ns()
+            loop_times[timed % TIMING_SAMPLES] = loop_stop - loop_start
+            disp_times[timed % TIMING_SAMPLES] = loop_stop - disp_start
+            timed += 1
+
+            if loop_stop >= next_report:
+                n = min(timed, TIMING_SAMPLES)
+                print(f"=== Iteration: {iteration} ({timed} loops since last report) ===")
+                print(f"voltage 1 (raw): {v1_raw:.4f} V, voltage 2 (raw): {v2_raw:.4f} V")
+                print(f"voltage 1 (offset): {v1_raw - v1_offset:.4f} V, voltage 2 (offset): {v2_raw - v2_offset:.4f} V")
+                print(f"Power 1: {power1:.6f} W, Power 2: {power2:.6f} W")
+                print(f"display run time: {disp_times[:n].mean() / 1e9} seconds avg | "
+                      f"Total loop run time: {loop_times[:n].mean() / 1e9} seconds avg, "
+                      f"{loop_times[:n].max() / 1e9} max")
+                timed = 0
+                next_report = loop_stop + DEBUG_INTERVAL_NS
 
 
 if __name__ == "__main__":